@@ -4,11 +4,43 @@ Base Collector class
 Implementing member functions and attributes shared by Collector objects
 """
 
+from functools import lru_cache
+
 import ee
 import pandas as pd
 
 # pylint: disable=no-member
 
+# names to reducer object lookup table
+REDUCER_LUT = {  'mean' : ee.Reducer.mean, \
+                'median' : ee.Reducer.median, \
+                'mode' :  ee.Reducer.mode, \
+                'max' : ee.Reducer.max, \
+                'min' : ee.Reducer.min \
+}
+
+@lru_cache( maxsize=128 )
+def _get_band_names( serialized ):
+
+    """
+    Get band names of first image in serialized image collection - memoised to avoid 
+    repeated round trips to earth engine for the same collection
+    
+    Parameters        
+    ----------
+    serialized : str
+        JSON serialized ee.ImageCollection
+
+    Returns
+    -------
+    tuple :
+        band names of first image in collection
+    """
+
+    collection = ee.ImageCollection( ee.deserializer.fromJSON( serialized ) )
+    return tuple( collection.first().bandNames().getInfo() )
+
+
 class BaseCollector():
 
     """
@@ -22,13 +54,8 @@ class BaseCollector():
         Generate a list of temporal intervals
     """
 
-    # names to reducer object lookup table
-    _reducer_lut = {  'mean' : ee.Reducer.mean, \
-                        'median' : ee.Reducer.median, \
-                        'mode' :  ee.Reducer.mode, \
-                        'max' : ee.Reducer.max, \
-                        'min' : ee.Reducer.min \
-    }
+    # names to reducer object lookup table - shared with subclasses
+    reducer_lut = REDUCER_LUT
 
     @staticmethod
     def add_metadata( image, interval ):
@@ -83,13 +110,18 @@ class BaseCollector():
         # get periods between start and end at frequency
         period = pd.period_range( start=start, end=end, freq=freq )
 
-        # get start and end of period
-        d1 = period.to_timestamp(how='start').normalize()
-        d2 = period.to_timestamp(how='end').normalize()
+        # single period - skip vectorised conversion
+        if len( period ) == 1:
+            return [ { 'start': period[ 0 ].start_time.strftime( '%Y-%m-%d' ),
+                       'end': period[ 0 ].end_time.strftime( '%Y-%m-%d' ) } ]
 
-        # convert to strings
-        d1 = [ d.strftime( '%Y-%m-%d' ) for d in d1 ]
-        d2 = [ d.strftime( '%Y-%m-%d' ) for d in d2 ]
+        # get start and end of period - vectorised period boundaries
+        d1 = period.start_time.normalize()
+        d2 = period.end_time.normalize()
+
+        # convert to strings - vectorised over datetime index
+        d1 = d1.strftime( '%Y-%m-%d' )
+        d2 = d2.strftime( '%Y-%m-%d' )
 
         # zip up dates
         return [{ 'start': x, 'end': y } for x, y in zip( d1, d2 ) ]
@@ -113,7 +145,8 @@ class BaseCollector():
         Returns
         -------
         ee.ImageCollection : 
-            Image collection comprising interval aggregated images
+            Image collection comprising interval aggregated images - intervals with no
+            images yield an empty (fully masked) image rather than being skipped
         """
 
         # parse keyword args
@@ -121,50 +154,51 @@ class BaseCollector():
         meta_type = kwargs.get( 'meta_type', 'aggregation_period' )
         names = kwargs.get( 'names' )
 
-        # list to store outputs
-        images = ee.List([])
+        # get reducer object
+        reducer = REDUCER_LUT[ method ] ()
 
-        # iterate over intervals
-        for interval in intervals:
+        # server-side map function reducing collection over single interval
+        def reduce_interval( interval ):
 
             # get range of date filter
-            d1 = ee.Date( interval[ 'start' ] )
-            d2 = ee.Date( interval[ 'end' ] )
-
-            try:
-
-                # apply reduction between dates
-                if d1 == d2:
-                    subset = collection.filterDate(d1)
-                else:
-                    subset = collection.filterDate(d1, d2)
-
-                image = subset.reduce( BaseCollector._reducer_lut[ method ] () )
+            interval = ee.Dictionary( interval )
+            d1 = ee.Date( interval.get( 'start' ) )
+            d2 = ee.Date( interval.get( 'end' ) )
+
+            # apply reduction between dates
+            subset = ee.ImageCollection( ee.Algorithms.If( d1.millis().eq( d2.millis() ),
+                                                            collection.filterDate( d1 ),
+                                                            collection.filterDate( d1, d2 ) )
+            )
 
-                # optional rename
-                if names is not None:
-                    image = image.rename( names )
+            # substitute fully masked image with same bands for empty subset
+            empty = collection.reduce( reducer ).updateMask( 0 )
+            image = ee.Image( ee.Algorithms.If( subset.size().gt( 0 ),
+                                                subset.reduce( reducer ),
+                                                empty )
+            )
 
-                # record temporal period of aggregation
-                if meta_type == 'aggregation_period':
+            # optional rename
+            if names is not None:
+                image = image.rename( names )
 
-                    # add start and end dates as metafields
-                    meta = ee.Dictionary( { 'system:time_start' : d1.millis(), \
-                                                'system:time_end' : d2.millis() } )
+            # record temporal period of aggregation
+            if meta_type == 'aggregation_period':
 
-                else:
+                # add start and end dates as metafields
+                meta = ee.Dictionary( { 'system:time_start' : d1.millis(), \
+                                            'system:time_end' : d2.millis() } )
 
-                    # add interpolated date as meta property
-                    d = d1.advance( d2.difference( d1, 'days' ).divide( 2 ), 'days' )
-                    meta = ee.Dictionary( { 'system:time_start' : d.millis() } )
+            else:
 
-                images = images.add( image.set(  meta ) )
+                # add interpolated date as meta property
+                d = d1.advance( d2.difference( d1, 'days' ).divide( 2 ), 'days' )
+                meta = ee.Dictionary( { 'system:time_start' : d.millis() } )
 
-            except BaseException as err:
+            return image.set( meta )
 
-                # exception - probably caused by empty subset
-                print ( err )
-                continue
+        # reduce all intervals in single server-side map
+        images = ee.List( intervals ).map( reduce_interval )
 
         # return reduced images as new image collection
         return ee.ImageCollection.fromImages( images )
@@ -194,7 +228,7 @@ class BaseCollector():
             names = [ names ]
 
         # remove label band
-        current_bands = list( collection.first().bandNames().getInfo() )
+        current_bands = _get_band_names( collection.serialize() )
         new_bands = [ b for b in current_bands if b not in names ]
 
         return collection.select( new_bands )
@@ -59,13 +59,9 @@ class DynamicWorld( BaseCollector ):
                'snow' : '#B39FE1'
     }
 
-    # names to reducer object lookup table
-    reducer_lut = {  'mean' : ee.Reducer.mean, \
-                    'median' : ee.Reducer.median, \
-                    'mode' :  ee.Reducer.mode, \
-                    'max' : ee.Reducer.max, \
-                    'min' : ee.Reducer.min \
-    }
+    # legend names and colours as lists
+    legend_names = list( legend.keys() )
+    palette = list( legend.values() )
 
     @staticmethod
     def get_data( roi, start_date, end_date ):
@@ -112,13 +108,15 @@ class DynamicWorld( BaseCollector ):
             Image with label and confidence bands
         """
 
+        # project label band once - shared by mode and confidence
+        labels = collection.select( 'label' )
+
         # compute most frequent top-1 label across time series
-        label = collection.select( 'label' ) \
-                    .reduce( ee.Reducer.mode() ).rename( 'label' )
+        label = labels.reduce( ee.Reducer.mode() ).rename( 'label' )
 
         # use normalised count as confidence score
         return label.addBands(
-            DynamicWorld.get_mode_confidence( collection, 'label', label )
+            DynamicWorld.get_mode_confidence( labels, 'label', label )
         )
     
 
@@ -143,24 +141,17 @@ class DynamicWorld( BaseCollector ):
             Percentage of valid observations matching mode label (0-100)
         """
 
-        # create binary images where value equals target image
+        # create binary images where value equals target image - masked where no data
         def get_match( image ) :
-            match = image.select( band ).eq( target )
-            return match.updateMask( image.select( band ).mask() )
-
-        # get sum of matches per pixel
-        matches = collection.map( get_match ) \
-                        .reduce( ee.Reducer.sum() )
+            return image.select( band ).eq( target ).rename( 'match' )
 
-        # get count of valid observations per pixel
-        def get_nodata_mask( image ):
-            return image.select( band ).mask()
-
-        max_obs_count = collection.map( get_nodata_mask ) \
-                                .reduce( ee.Reducer.sum() )
+        # get sum of matches and count of valid observations per pixel in one reduction
+        reducer = ee.Reducer.sum().combine( ee.Reducer.count(), sharedInputs=True )
+        stats = collection.map( get_match ) \
+                        .reduce( reducer )
 
         # return match count by valid observation count
-        return matches.divide( max_obs_count ) \
+        return stats.select( 'match_sum' ).divide( stats.select( 'match_count' ) ) \
                     .multiply( 100 ).toInt() \
                     .rename('confidence')
 
@@ -183,16 +174,19 @@ class DynamicWorld( BaseCollector ):
         """
 
         # compute per-pixel median probability values
-        median = collection.select( DynamicWorld.probability_bands ).median()
+        probs = collection.select( DynamicWorld.probability_bands )
+        median = probs.median()
+
+        # convert to per-pixel array once - shared by label and confidence
+        median_arr = median.toArray()
 
-        # extract index of highest median probability - use to identify label 
-        label = median.toArray() \
-                .arrayArgmax() \
+        # extract index of highest median probability - use to identify label
+        label = median_arr.arrayArgmax() \
                 .arrayGet([0] ).rename( 'label' )
 
         # use maximum median probability as confidence
         return label.addBands(
-            DynamicWorld.get_max_median_confidence( median.toArray() )
+            DynamicWorld.get_max_median_confidence( median_arr )
         )
 
     @staticmethod
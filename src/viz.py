@@ -6,16 +6,19 @@ from the Dynamic World dataset.
 """
 
 from io import BytesIO
+from datetime import datetime, timezone
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import numpy as np
-import scipy.stats as stats
+import scipy.signal as signal
 import matplotlib.pyplot as plt
 
 import ee
 import geemap
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageColor, ImageDraw, ImageFont, ImageSequence
 from IPython.display import Image as IPyImage
 
 from dw import DynamicWorld
@@ -34,10 +37,28 @@ class Viz():
         Create a simple animated GIF from an image collection.
     get_annotated_animation: 
         Create an annotated GIF with timestamps for each frame.
+    get_kde:
+        Evaluate FFT-based gaussian kernel density estimate.
     """
 
+    # default font used to annotate animation frames
+    font = ImageFont.load_default()
+
+    # shared quantization palette - legend colours plus white and black annotation colours
+    palette_colors = DynamicWorld.palette + [ '#FFFFFF', '#000000' ]
+
+    palette_image = Image.new( 'P', ( 1, 1 ) )
+    palette_image.putpalette( [ value for color in palette_colors
+                                    for value in ImageColor.getrgb( color ) ] )
+
+    # gif output palette - appends reserved colour marking pixels unchanged from previous
+    # frame as transparent, never produced by quantization
+    transparency = len( palette_colors )
+    gif_palette = [ value for color in palette_colors + [ '#FF00FF' ]
+                        for value in ImageColor.getrgb( color ) ]
+
     @staticmethod
-    def plot_label_images( datasets, roi, zoom=10 ):
+    def plot_label_images( datasets, roi, zoom=10, center=None ):
 
         """
         Display mode and max-median aggregated Dynamic World land cover images on
@@ -47,6 +68,9 @@ class Viz():
         ----------
         datasets : dict
             temporally aggregated Dynamic World images
+        center : list, optional
+            map centre as [ lat, lon ] - cache and reuse across calls on same roi to
+            avoid round trip computing roi centroid
 
         Returns
         -------
@@ -54,15 +78,19 @@ class Viz():
             interactive folium map
         """
 
+        # compute map centre from roi centroid if not provided
+        if center is None:
+            center = roi.centroid().coordinates().getInfo()[::-1]
+
         # create folium object
-        m = geemap.Map( center=roi.centroid().coordinates().getInfo()[::-1],
+        m = geemap.Map( center=center,
                         zoom=zoom,
                         add_google_map=False
         )
 
         # legend keys and values
-        keys = list( DynamicWorld.legend.keys() )
-        colors = list( DynamicWorld.legend.values() )
+        keys = DynamicWorld.legend_names
+        colors = DynamicWorld.palette
 
         # add results to interactive map
         for idx, dataset in enumerate( datasets ):
@@ -71,9 +99,12 @@ class Viz():
 
                 if isinstance( v, ee.Image ):
 
+                    # convert labels to rgb once - layer rendered without vis params
+                    rgb = v.select( 'label' ).visualize( min=0, max=8, palette=colors )
+
                     # display mode landcover
-                    m.addLayer( v.select( 'label' ),
-                            { 'min' : 0, 'max' : 8, 'palette' : colors },
+                    m.addLayer( rgb,
+                                {},
                                 f'{k}: { dataset[ "name" ] }',
                                 idx == 0 )
 
@@ -113,7 +144,7 @@ class Viz():
                             image.select( 'label' ) \
                                 .visualize( min=0,
                                             max=8,
-                                            palette=list( DynamicWorld.legend.values() ) )
+                                            palette=DynamicWorld.palette )
         )
         return IPyImage(url=rgb.getVideoThumbURL( { 'crs' : crs,
                                                     'dimensions' : dimensions, 
@@ -159,89 +190,163 @@ class Viz():
             return image.visualize(
                 min=0,
                 max=8,
-                palette=list(DynamicWorld.legend.values())
+                palette=DynamicWorld.palette
             ).set({'system:time_start': image.get('system:time_start')})
 
         # get rgb images
-        images = collection.map(visualise_rgb).toList(collection.size())
-        frames = []
+        rgb = collection.map(visualise_rgb)
+
+        # retrieve frame count from collection size - timestamps in same round trip if needed
+        request = {'size': collection.size()}
+        if not annotation:
+            request['timestamps'] = collection.aggregate_array('system:time_start')
+        info = ee.Dictionary(request).getInfo()
+
+        # empty collection - nothing to animate
+        num_frames = info['size']
+        if num_frames == 0:
+            raise ValueError('collection contains no images to animate')
+
+        # use annotation labels if matching frame count - otherwise image dates
+        use_dates = len(annotation) != num_frames
+        labels = annotation
+
+        if use_dates:
+
+            # annotation supplied but mismatched - timestamps not yet retrieved
+            timestamps = info.get('timestamps')
+            if timestamps is None:
+                timestamps = collection.aggregate_array('system:time_start').getInfo()
+
+            # images without timestamp cannot be labelled by date
+            if len(timestamps) != num_frames:
+                raise ValueError(
+                    f'{num_frames - len(timestamps)} of {num_frames} images have no '
+                    f'system:time_start - supply {num_frames} annotation labels instead'
+                )
+
+            # format locally as utc dates
+            labels = [
+                datetime.fromtimestamp(ts / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+                for ts in timestamps
+            ]
+
+        # render base animation server-side - single request for all frames
+        url = rgb.getVideoThumbURL({
+            'region': roi,
+            'dimensions': dimensions,
+            'crs': crs,
+            'format': 'gif'
+        })
+
+        # rendered label banners - drawn once per unique label
+        banners = {}
+        padding = 4
+
+        # date labels share fixed-width digits - measure text size once
+        date_bbox = Viz.font.getbbox('0000-00-00')
+
+        # inline function to render label banner as white background with text
+        def get_banner(label):
+
+            if label not in banners:
+
+                # calculate text size - only custom annotation labels measured individually
+                bbox = date_bbox if use_dates else Viz.font.getbbox(label)
+                text_width = bbox[2] - bbox[0]
+                text_height = bbox[3] - bbox[1]
+
+                # draw text on background rectangle
+                size = (text_width + 2 * padding + 1, text_height + 2 * padding + 1)
+                banner = Image.new('RGB', size, 'white')
+                ImageDraw.Draw(banner).text((padding, padding), label, font=Viz.font, fill='black')
+                banners[label] = (banner, text_width, text_height)
+
+            return banners[label]
+
+        # inline function to annotate image frame
+        def annotate_frame(byte_image, label):
+
+            # get banner and position centred at bottom of frame
+            banner, text_width, text_height = get_banner(label)
 
-        # iterate over image frames
-        for idx in range(images.size().getInfo()):
+            text_x = (byte_image.width - text_width) // 2
+            text_y = byte_image.height - text_height - 10
 
-            # get image
-            image = ee.Image(images.get(idx))
+            # paste banner onto frame
+            byte_image.paste(banner, (text_x - padding, text_y - padding))
 
-            # get annotation label
-            if len(annotation) == images.size().getInfo():
-                label = annotation[idx]
-            else:
-                label = ee.Date(image.get('system:time_start')).format('YYYY-MM-dd').getInfo()
+            # quantize to shared palette - identical colour table for every frame
+            return byte_image.quantize(palette=Viz.palette_image, dither=Image.Dither.NONE)
 
-            # get thumbnail url
-            url = image.getThumbURL({
-                'region': roi,
-                'dimensions': dimensions,
-                'crs': crs
-            })
+        # inline generator to lazily decode and annotate frames - consumed by gif encoder
+        def get_frames(animation):
 
-            # retrieve byte image via url
-            response = requests.get(url, timeout=100)
-            byte_image = Image.open(BytesIO(response.content)).convert('RGB')
+            previous = None
+            for frame, label in zip(ImageSequence.Iterator(animation), labels):
 
-            # annotate image frame with date label and background
-            draw = ImageDraw.Draw(byte_image)
-            font = ImageFont.load_default()
+                # decode and annotate frame
+                current = annotate_frame(frame.convert('RGB'), label)
+                values = np.asarray(current)
 
-            # calculate text size and position using textbbox
-            bbox = draw.textbbox((0, 0), label, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
+                # keep only pixels changed from previous frame - remainder transparent
+                if previous is not None:
+                    current = Image.fromarray(
+                        np.where(values == previous, Viz.transparency, values).astype(np.uint8)
+                    )
 
-            text_x = (byte_image.width - text_width) // 2
-            text_y = byte_image.height - text_height - 10
+                # apply output palette including reserved transparency colour
+                current.putpalette(Viz.gif_palette)
+
+                previous = values
+                yield current
+
+        # output to file if filename defined - otherwise in-memory buffer
+        target = out_pathname if out_pathname else BytesIO()
 
-            # draw background rectangle
-            padding = 4
-            draw.rectangle(
-                [
-                    text_x - padding,
-                    text_y - padding,
-                    text_x + text_width + padding,
-                    text_y + text_height + padding
-                ],
-                fill='white'
+        # session with retries on transient server errors - closed once animation retrieved
+        with requests.Session() as session:
+
+            retries = Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504]
             )
+            session.mount('https://', HTTPAdapter(max_retries=retries))
 
-            # draw text
-            draw.text((text_x, text_y), label, font=font, fill='black')
+            # retrieve animation via url
+            response = session.get(url, timeout=100)
 
-            # append frame
-            frames.append(byte_image)
+        # decode, annotate and encode frames - animation released once written
+        with Image.open(BytesIO(response.content)) as animation:
 
-        # output filename defined
-        if out_pathname:
-            frames[0].save(
-                out_pathname,
+            # one label per decoded frame - avoid silent truncation by zip
+            decoded = getattr(animation, 'n_frames', 1)
+            if decoded != len(labels):
+                raise ValueError(
+                    f'animation has {decoded} frames but {len(labels)} labels were generated'
+                )
+
+            frames = get_frames(animation)
+            first = next(frames)
+            first.save(
+                target,
+                format='GIF',
                 save_all=True,
-                append_images=frames[1:],
+                append_images=frames,
                 duration=int(1000 / fps),
+                transparency=Viz.transparency,
+                disposal=1,
                 loop=0
             )
+
+        # output filename defined
+        if out_pathname:
             print(f'GIF saved to {out_pathname}')
             return out_pathname
-        else:
-            buffer = BytesIO()
-            frames[0].save(
-                buffer,
-                format='GIF',
-                save_all=True,
-                append_images=frames[1:],
-                duration=int(1000 / fps),
-                loop=0
-            )
-            buffer.seek(0)
-            return IPyImage(data=buffer.read())
+
+        target.seek(0)
+        return IPyImage(data=target.read())
 
 
     @staticmethod
@@ -264,32 +369,43 @@ class Viz():
                                 nrows=1 )
         axes = np.ravel( axes )
 
+        # split confidence scores by method and label in single pass - group on categorical codes
+        methods = df[ 'method' ].astype( 'category' )
+        groups = df.groupby( [ methods, 'label' ], observed=True )[ 'confidence' ]
+        samples = { key : group.values for key, group in groups }
+
+        # select targeted land cover classes with legend index and colour
+        targets = set( targets )
+        classes = [ ( label_idx, k, v )
+                        for label_idx, ( k, v ) in enumerate( DynamicWorld.legend.items() )
+                            if k in targets ]
+
         # iterate over predictors
         for axis_idx, method in enumerate( [ 'mode', 'max_median' ] ):
 
-            subset = df[ df.method == method ]
-            limits = []
-
-            # iterate over land cover classes
-            for label_idx, (k, v) in enumerate( list( DynamicWorld.legend.items() ) ):
+            # preallocate per-class min and max limits
+            limits = np.empty( ( len( classes ), 2 ), dtype=np.float64 )
+            count = 0
 
-                if k in targets:
+            # iterate over targeted land cover classes
+            for label_idx, k, v in classes:
 
-                    # extract land cover samples
-                    data = subset[ subset.label == label_idx ][ 'confidence' ].values
-                    if len( data ) > 0:
+                # extract land cover samples
+                data = samples.get( ( method, label_idx ), [] )
+                if len( data ) > 0:
 
-                        # compute mean and std
-                        mean = np.mean( data )
-                        std = np.std( data )
+                    # compute mean and std
+                    mean = np.mean( data )
+                    std = np.std( data )
 
-                        # get min and max limits
-                        limits.append( ( mean - std * 2.5, mean + std * 2.5 ) )
-                        x = np.linspace( limits[-1][0], limits[-1][1], num=100 )
+                    # get min and max limits
+                    limits[ count ] = ( mean - std * 2.5, mean + std * 2.5 )
+                    x = np.linspace( limits[ count, 0 ], limits[ count, 1 ], num=100 )
+                    count += 1
 
-                        # plot best fit gausssian function
-                        density = stats.gaussian_kde( data )
-                        axes[ axis_idx ].plot( x, density(x), color=v, label=k )
+                    # plot best fit gausssian function
+                    density = Viz.get_kde( data, x )
+                    axes[ axis_idx ].plot( x, density, color=v, label=k )
 
             # update title and legend
             axes[ axis_idx ].set_title( f'{method} : confidence scores' )
@@ -298,7 +414,49 @@ class Viz():
             axes[ axis_idx ].legend()
 
             # tweak x-axis limits
-            axes[ axis_idx ].set_xlim( np.percentile( np.array( limits )[ :, 0 ], 70 ),
-                                    np.percentile( np.array( limits )[ :, 1 ], 70 ) )
+            axes[ axis_idx ].set_xlim( np.percentile( limits[ :count, 0 ], 70 ),
+                                    np.percentile( limits[ :count, 1 ], 70 ) )
 
         return axes
+
+
+    @staticmethod
+    def get_kde( data, x, num=1024 ):
+
+        """
+        Evaluate gaussian kernel density estimate by convolving binned samples with 
+        gaussian kernel via fft - bandwidth selected using Scott's rule
+        
+        Parameters
+        ----------
+        data : np.array
+            1D array of samples
+        x : np.array
+            evaluation points
+        num : int
+            number of bins in regular grid
+
+        Returns
+        -------
+        np.array :
+            density evaluated at x
+        """
+
+        # scott's rule bandwidth - matches scipy gaussian_kde default
+        data = np.asarray( data, dtype=float )
+        bw = np.std( data, ddof=1 ) * len( data ) ** ( -1 / 5 )
+
+        # bin samples onto regular grid spanning samples, evaluation points and kernel support
+        lo = min( data.min(), np.min( x ) ) - 4 * bw
+        hi = max( data.max(), np.max( x ) ) + 4 * bw
+        counts, edges = np.histogram( data, bins=num, range=( lo, hi ) )
+        centres = ( edges[ :-1 ] + edges[ 1: ] ) / 2
+
+        # sample gaussian kernel at grid spacing out to 4 bandwidths
+        delta = edges[ 1 ] - edges[ 0 ]
+        offsets = np.arange( -np.ceil( 4 * bw / delta ), np.ceil( 4 * bw / delta ) + 1 ) * delta
+        kernel = np.exp( -0.5 * ( offsets / bw ) ** 2 ) / ( bw * np.sqrt( 2 * np.pi ) )
+
+        # convolve and interpolate density onto evaluation points
+        density = signal.fftconvolve( counts, kernel, mode='same' ) / len( data )
+        return np.interp( x, centres, density )